@@ -5,7 +5,7 @@ from .config import Config
 import sentry_sdk
 from sentry_sdk.integrations.flask import FlaskIntegration
 from .routes import bp as api_bp
-from .extensions import mongo  # import the unbound instance
+from .extensions import mongo, audit  # import the unbound instances
 
 def create_app():
     app = Flask(__name__)
@@ -20,6 +20,7 @@ def create_app():
         )
 
     mongo.init_app(app)
+    audit.init_app(app)
     jwt = JWTManager(app)
     CORS(app)
 
@@ -0,0 +1,420 @@
+import atexit
+import fcntl
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import bson
+from bson import json_util
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Client-supplied values end up in details; keep any one event far below
+# Mongo's 16 MB document limit.
+MAX_DETAIL_LENGTH = 256
+MAX_DETAIL_ITEMS = 20
+MAX_DETAIL_DEPTH = 3
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+
+
+def _clip(value, depth=0):
+    if value is None or isinstance(value, (bool, float)):
+        return value
+    if isinstance(value, int):
+        return value if -2 ** 63 <= value < 2 ** 63 else _clip(str(value), depth)
+    if isinstance(value, str):
+        if len(value) <= MAX_DETAIL_LENGTH:
+            return value
+        return value[:MAX_DETAIL_LENGTH] + f"...[{len(value) - MAX_DETAIL_LENGTH} more]"
+    if depth >= MAX_DETAIL_DEPTH:
+        return "...[nested]"
+    if isinstance(value, dict):
+        items = list(value.items())
+        clipped = {_clip(str(k)): _clip(v, depth + 1) for k, v in items[:MAX_DETAIL_ITEMS]}
+        if len(items) > MAX_DETAIL_ITEMS:
+            clipped["..."] = f"[{len(items) - MAX_DETAIL_ITEMS} more]"
+        return clipped
+    if isinstance(value, (list, tuple)):
+        clipped = [_clip(v, depth + 1) for v in value[:MAX_DETAIL_ITEMS]]
+        if len(value) > MAX_DETAIL_ITEMS:
+            clipped.append(f"...[{len(value) - MAX_DETAIL_ITEMS} more]")
+        return clipped
+    return _clip(str(value), depth)
+
+
+class AuditLog:
+    """Write-behind security audit log.
+
+    Handlers call ``record`` which only enqueues the event; a background
+    thread drains the queue and writes batches with ``insert_many``. Events
+    that cannot reach Mongo are appended to a local spool file and replayed
+    on the next successful flush. Events Mongo can never accept are moved to
+    ``<spool>.bad``.
+    """
+
+    def __init__(self, mongo=None):
+        self.mongo = mongo
+        self.collection_name = "audit_events"
+        self.batch_size = 100
+        self.flush_interval = 1.0
+        self.retention_days = 365
+        self.spool_path = "audit_spool.jsonl"
+        self._queue = queue.Queue(maxsize=10000)
+        self._batch = []
+        self._spool_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._collection_ready = False
+        self._enabled = False
+
+    def init_app(self, app):
+        # create_app() may run more than once per process (tests); the first
+        # configuration wins so queued events are never orphaned.
+        if self._enabled:
+            return
+        self.collection_name = app.config.get('AUDIT_COLLECTION', self.collection_name)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', self.flush_interval)
+        self.retention_days = app.config.get('AUDIT_RETENTION_DAYS', self.retention_days)
+        self.spool_path = app.config.get('AUDIT_SPOOL_PATH', self.spool_path)
+        self._queue = queue.Queue(maxsize=app.config.get('AUDIT_QUEUE_SIZE', 10000))
+        self._enabled = True
+        atexit.register(self.shutdown)
+
+    def record(self, event, user_id=None, success=True, ip=None, **details):
+        if not self._enabled:
+            return
+        doc = {
+            "timestamp": datetime.utcnow(),
+            "meta": {"event": event, "userId": _clip(user_id)},
+            "success": success,
+            "ip": _clip(ip),
+        }
+        if details:
+            doc["details"] = _clip(details)
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(doc)
+        except queue.Full:
+            # Never drop audit events: spill straight to the spool when the
+            # flusher can't keep up.
+            self._spool([doc])
+
+    def flush(self):
+        """Drain everything currently queued and write it out."""
+        self._write(self._drain())
+
+    def shutdown(self, timeout=5.0):
+        """Stop the flusher within ``timeout`` seconds.
+
+        Shutdown itself never waits on Mongo: whatever the flusher has not
+        written by the deadline goes to the spool for the next process.
+        """
+        deadline = time.monotonic() + timeout
+        thread = self._thread
+        stuck = False
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(max(deadline - time.monotonic(), 0))
+            stuck = thread.is_alive()
+        # A stuck flusher's batch may still reach Mongo; a duplicate beats a
+        # lost event. A flusher that stopped cleanly has an empty batch.
+        pending = list(self._batch) + self._drain()
+        self._batch = []
+        if stuck:
+            logger.warning("Audit flusher did not stop in %.1fs, spooling %d events", timeout, len(pending))
+            # Let it exit once Mongo answers, rather than running alongside a
+            # second flusher started by the next record()
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        else:
+            self._thread = None
+        self._spool(pending)
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                doc = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if doc is not _STOP:
+                batch.append(doc)
+
+    def _ensure_started(self):
+        # Gunicorn forks workers after import, so each process needs its own
+        # flusher thread; a thread that died is replaced too.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                doc = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                doc = None
+            if doc is not None and doc is not _STOP:
+                self._batch.append(doc)
+            if doc is _STOP or len(self._batch) >= self.batch_size or time.monotonic() >= deadline:
+                try:
+                    self._write(self._batch)
+                except Exception:
+                    logger.exception("Audit flush failed, spooling %d events", len(self._batch))
+                    try:
+                        self._spool(self._batch)
+                    except OSError:
+                        # Keep the batch in memory and retry next interval
+                        logger.exception("Audit spool write failed, %d events pending", len(self._batch))
+                        if doc is _STOP:
+                            return
+                        deadline = time.monotonic() + self.flush_interval
+                        continue
+                self._batch = []
+                if doc is _STOP:
+                    return
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch):
+        with self._flush_lock:
+            if not batch and not self._spool_pending():
+                return
+            try:
+                collection = self._collection()
+            except PyMongoError as e:
+                logger.warning("Audit flush failed, spooling %d events: %s", len(batch), e)
+                self._spool(batch)
+                return
+            try:
+                self._replay_spool(collection)
+            except PyMongoError as e:
+                # Mongo is unreachable; don't wait out a second timeout
+                logger.warning("Audit spool replay failed, spooling %d events: %s", len(batch), e)
+                self._spool(batch)
+                return
+            except Exception:
+                logger.exception("Audit spool replay failed")
+            try:
+                failed = self._insert(collection, batch)
+            except PyMongoError as e:
+                logger.warning("Audit flush failed, spooling %d events: %s", len(batch), e)
+                failed = batch
+            # Rejected events get one more try via the spool replay, which
+            # quarantines anything rejected again.
+            self._spool(failed)
+
+    def _insert(self, collection, docs):
+        """Insert ``docs`` and return the ones rejected by a partial bulk
+        failure. Documents that can never be encoded are quarantined up
+        front; any other Mongo error is raised."""
+        valid = self._encodable(docs)
+        if not valid:
+            return []
+        try:
+            collection.insert_many(valid, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            logger.warning("Audit insert partially failed, %d of %d events", len(failed), len(valid))
+            return [doc for i, doc in enumerate(valid) if i in failed]
+        return []
+
+    def _encodable(self, docs):
+        """Return the docs Mongo can store, quarantining the rest."""
+        valid = []
+        invalid = []
+        for doc in docs:
+            try:
+                if len(bson.encode(doc)) > MAX_DOCUMENT_SIZE:
+                    raise bson.errors.InvalidDocument("document too large")
+                valid.append(doc)
+            except (bson.errors.InvalidDocument, OverflowError, TypeError, ValueError) as e:
+                logger.error("Quarantining unencodable audit event: %s", e)
+                invalid.append(doc)
+        self._quarantine(invalid)
+        return valid
+
+    def _collection(self):
+        db = self.mongo.db
+        if not self._collection_ready:
+            self._ensure_collection(db)
+            self._collection_ready = True
+        return db[self.collection_name]
+
+    def _ensure_collection(self, db):
+        ttl = self.retention_days * 86400
+        try:
+            db.create_collection(
+                self.collection_name,
+                timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"},
+                expireAfterSeconds=ttl
+            )
+            return
+        except CollectionInvalid:
+            info = next(iter(db.list_collections(filter={"name": self.collection_name})), {})
+        except OperationFailure as e:
+            logger.error("Time-series collections need MongoDB 5.0+; audit events go to a "
+                         "regular collection with a TTL index instead: %s", e)
+            info = {}
+        if info.get("type") == "timeseries":
+            db.command("collMod", self.collection_name, expireAfterSeconds=ttl)
+            return
+        if info:
+            logger.error("Audit collection %s exists but is not time-series; "
+                         "enforcing retention with a TTL index", self.collection_name)
+        try:
+            db[self.collection_name].create_index("timestamp", expireAfterSeconds=ttl)
+        except OperationFailure:
+            # TTL index exists with a different retention
+            db.command("collMod", self.collection_name,
+                       index={"keyPattern": {"timestamp": 1}, "expireAfterSeconds": ttl})
+
+    def _replay_path(self, pid=None):
+        return f"{self.spool_path}.replay.{pid or os.getpid()}"
+
+    def _spool_pending(self):
+        return os.path.exists(self.spool_path) or bool(glob.glob(self._replay_path("*")))
+
+    def _spool(self, batch):
+        if not batch:
+            return
+        lines = []
+        for doc in batch:
+            try:
+                lines.append(json_util.dumps(doc) + "\n")
+            except (TypeError, ValueError):
+                self._quarantine([doc])
+        self._append_locked(self.spool_path, "".join(lines))
+
+    def _quarantine(self, docs):
+        if not docs:
+            return
+        lines = []
+        for doc in docs:
+            try:
+                lines.append(json_util.dumps(doc) + "\n")
+            except (TypeError, ValueError):
+                lines.append(repr(doc) + "\n")
+        self._append_locked(self.spool_path + ".bad", "".join(lines))
+
+    def _append_locked(self, path, data):
+        if not data:
+            return
+        # The spool is shared by every worker: appends and claims both hold an
+        # flock, and a writer that raced a claim reopens the fresh file.
+        with self._spool_lock:
+            while True:
+                with open(path, "a") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        try:
+                            current = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        if os.path.samestat(os.fstat(f.fileno()), current):
+                            f.write(data)
+                            return
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _claim_leftover(self):
+        replay_path = self._replay_path()
+        return replay_path if os.path.exists(replay_path) else None
+
+    def _claim_orphan(self):
+        """Adopt a replay file left behind by a worker that has exited."""
+        replay_path = self._replay_path()
+        for path in glob.glob(self._replay_path("*")):
+            try:
+                pid = int(path.rsplit(".", 1)[1])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.replace(path, replay_path)
+                    return replay_path
+                except FileNotFoundError:
+                    continue
+            except (ValueError, OSError):
+                continue
+        return None
+
+    def _claim_shared(self):
+        """Move the shared spool to this process's replay file."""
+        replay_path = self._replay_path()
+        with self._spool_lock:
+            while True:
+                try:
+                    f = open(self.spool_path)
+                except FileNotFoundError:
+                    return None
+                with f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        # Another worker may have claimed it while we waited
+                        if not os.path.samestat(os.fstat(f.fileno()), os.stat(self.spool_path)):
+                            continue
+                        os.replace(self.spool_path, replay_path)
+                        return replay_path
+                    except FileNotFoundError:
+                        return None
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _replay_spool(self, collection):
+        # An interrupted replay first, then a dead worker's, then the shared
+        # spool. Each file is removed once replayed, so they can share a path.
+        for claim in (self._claim_leftover, self._claim_orphan, self._claim_shared):
+            replay_path = claim()
+            if replay_path is not None:
+                self._replay_file(collection, replay_path)
+
+    def _replay_file(self, collection, replay_path):
+        docs = []
+        bad = []
+        with open(replay_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    docs.append(json_util.loads(line))
+                except Exception:
+                    bad.append(line if line.endswith("\n") else line + "\n")
+        if bad:
+            logger.error("Quarantined %d unreadable audit spool lines to %s.bad", len(bad), self.spool_path)
+            self._append_locked(self.spool_path + ".bad", "".join(bad))
+        docs = self._encodable(docs)
+        try:
+            rejected = self._insert(collection, docs)
+        except PyMongoError:
+            # Mongo is unreachable: keep the parsed events for the next flush
+            tmp_path = replay_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for doc in docs:
+                    f.write(json_util.dumps(doc) + "\n")
+            os.replace(tmp_path, replay_path)
+            raise
+        if rejected:
+            # Already retried once from the spool; Mongo won't take these
+            logger.error("Quarantined %d audit events rejected by Mongo to %s.bad", len(rejected), self.spool_path)
+            self._quarantine(rejected)
+        os.remove(replay_path)
@@ -8,3 +8,8 @@ class Config:
     PAYSTACK_SECRET_KEY = os.environ.get('PAYSTACK_SECRET_KEY')
     MONO_SECRET_KEY = os.environ.get('MONO_SECRET_KEY')
     FLASK_ENV = os.environ.get('FLASK_ENV') or 'production'
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE') or 100)
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL') or 1.0)
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE') or 10000)
+    AUDIT_RETENTION_DAYS = int(os.environ.get('AUDIT_RETENTION_DAYS') or 365)
+    AUDIT_SPOOL_PATH = os.environ.get('AUDIT_SPOOL_PATH') or 'audit_spool.jsonl'
@@ -1,4 +1,6 @@
 from flask_pymongo import PyMongo
+from .audit import AuditLog
 
 mongo = PyMongo()
+audit = AuditLog(mongo)
 # You can also add other extensions here if needed
@@ -9,6 +9,9 @@ from .extensions import mongo
 ENCRYPTION_KEY = b'QGQ2OYEWEanrk8RNHBWsO0KPVSk3JNaNcw38Pjw5bJg='
 cipher = Fernet(ENCRYPTION_KEY)
 
+class NotFoundError(ValueError):
+    pass
+
 class User:
     @classmethod
     def create(cls, email, phone, password):
@@ -131,9 +134,13 @@ class Transaction:
     @classmethod
     def authenticate(cls, transaction_id, user_id, biometric_types, templates):
         collection = mongo.db.transactions
+        if not ObjectId.is_valid(transaction_id):
+            raise NotFoundError("Invalid transaction")
         transaction = collection.find_one({"_id": ObjectId(transaction_id), "userId": ObjectId(user_id)})
         if not transaction or transaction["status"] != "initiated":
-            raise ValueError("Invalid transaction")
+            raise NotFoundError("Invalid transaction")
+        if len(set(biometric_types)) != len(biometric_types):
+            raise ValueError("Duplicate biometric factors")
         if len(biometric_types) < 2 and transaction["amount"] > 10000:
             raise ValueError("Multi-factor required for high-value transactions")
         for b_type, template in zip(biometric_types, templates):
@@ -1,12 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from .models import User, Biometric, Transaction
+from .models import User, Biometric, Transaction, NotFoundError
+from .extensions import audit
 import bcrypt
+import hashlib
+import hmac
 import requests
 from .config import Config
 
 bp = Blueprint('api', __name__)
 
+def audit_event(event, user_id=None, success=True, **details):
+    # Only enqueues; the audit flusher writes to Mongo off the request path
+    audit.record(event, user_id=user_id, success=success, ip=request.remote_addr, **details)
+
+def identifier_hash(identifier):
+    # Users sometimes type their password as the identifier; keep only a
+    # keyed hash so failed logins can be correlated without storing it
+    key = current_app.config['SECRET_KEY'].encode('utf-8')
+    return hmac.new(key, str(identifier).encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
 @bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -17,6 +30,7 @@ def register():
         return jsonify({"error": "Email and password required"}), 400
     try:
         user_id = User.create(email, phone, password)
+        audit_event("register", str(user_id))
         access_token = create_access_token(identity=str(user_id))
         return jsonify({"userId": str(user_id), "jwt": access_token}), 201
     except ValueError as e:
@@ -31,7 +45,10 @@ def login():
         return jsonify({"error": "Identifier and password required"}), 400
     user = User.find_by_email_or_phone(identifier)
     if not user or not bcrypt.checkpw(password.encode('utf-8'), user["passwordHash"]):
+        audit_event("login", str(user["_id"]) if user else None, success=False,
+                    identifierHash=identifier_hash(identifier))
         return jsonify({"error": "Invalid credentials"}), 401
+    audit_event("login", str(user["_id"]))
     access_token = create_access_token(identity=str(user["_id"]))
     return jsonify({"userId": str(user["_id"]), "jwt": access_token}), 200
 
@@ -66,8 +83,10 @@ def enroll_biometrics():
         return jsonify({"error": "Type and template required"}), 400
     try:
         biometric_id = Biometric.enroll(user_id, biometric_type, template)
+        audit_event("biometric.enroll", user_id, type=biometric_type, biometricId=str(biometric_id))
         return jsonify({"biometricId": str(biometric_id)}), 201
     except ValueError as e:
+        audit_event("biometric.enroll", user_id, success=False, type=biometric_type, reason=str(e))
         return jsonify({"error": str(e)}), 400
 
 @bp.route('/biometrics', methods=['GET'])
@@ -82,7 +101,9 @@ def list_biometrics():
 def delete_biometric(biometric_id):
     user_id = get_jwt_identity()
     if Biometric.delete(biometric_id, user_id):
+        audit_event("biometric.delete", user_id, biometricId=biometric_id)
         return jsonify({"success": True}), 200
+    audit_event("biometric.delete", user_id, success=False, biometricId=biometric_id)
     return jsonify({"error": "Biometric not found"}), 404
 
 @bp.route('/accounts/link', methods=['POST'])
@@ -139,8 +160,24 @@ def authenticate_transaction(transaction_id):
     data = request.get_json()
     biometric_types = data.get('biometricTypes', [])
     templates = data.get('templates', [])
-    if len(biometric_types) > 0:
-        pass
+    if not isinstance(biometric_types, list) or not isinstance(templates, list) \
+            or not biometric_types or len(biometric_types) != len(templates) \
+            or not all(isinstance(t, str) for t in biometric_types):
+        audit_event("transaction.authenticate", user_id, success=False,
+                    transactionId=transaction_id, factors=biometric_types, reason="malformed request")
+        return jsonify({"error": "Biometric types and templates required"}), 400
+    try:
+        Transaction.authenticate(transaction_id, user_id, biometric_types, templates)
+    except NotFoundError as e:
+        audit_event("transaction.authenticate", user_id, success=False,
+                    transactionId=transaction_id, factors=biometric_types, reason=str(e))
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        audit_event("transaction.authenticate", user_id, success=False,
+                    transactionId=transaction_id, factors=biometric_types, reason=str(e))
+        return jsonify({"error": str(e)}), 401
+    audit_event("transaction.authenticate", user_id, transactionId=transaction_id, factors=biometric_types)
+    return jsonify({"authenticated": True}), 200
 
 
 
@@ -0,0 +1,164 @@
+"""Per-request cost of audit logging.
+
+Run from backend/: python tests/audit_benchmark.py [--rtt-ms 1.0] [--requests 2000]
+
+Compares a bare ``AuditLog.record`` with a synchronous ``insert_one``, then
+times real requests through the Flask app (DELETE /biometrics/<id>,
+which records ``biometric.delete``) with auditing off, with a healthy Mongo,
+and with Mongo down while the audit queue is saturated so every event spills
+to the spool. Mongo is simulated with a collection that sleeps for one
+round-trip per call (or for the server selection timeout when down), so the
+numbers are reproducible without a database.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(BACKEND))
+
+QUEUE_SIZE = 1000
+SPOOL_DIR = tempfile.mkdtemp()
+os.environ['AUDIT_QUEUE_SIZE'] = str(QUEUE_SIZE)
+os.environ['AUDIT_SPOOL_PATH'] = os.path.join(SPOOL_DIR, 'audit_spool.jsonl')
+
+from pymongo.errors import ServerSelectionTimeoutError
+from werkzeug.test import Client
+from flask_jwt_extended import create_access_token
+from audit import AuditLog
+from backend import routes
+from backend.app import create_app
+from backend.extensions import audit
+
+class SlowCollection:
+    def __init__(self, rtt, outage=None):
+        self.rtt = rtt
+        self.outage = outage
+        self.count = 0
+
+    def insert_one(self, doc):
+        time.sleep(self.rtt)
+        self.count += 1
+
+    def insert_many(self, docs, ordered=True):
+        if self.outage is not None:
+            time.sleep(self.outage)
+            raise ServerSelectionTimeoutError("mongo down")
+        time.sleep(self.rtt)
+        self.count += len(docs)
+
+class SlowDB:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def create_collection(self, name, **kwargs):
+        time.sleep(self.collection.rtt)
+
+    def __getitem__(self, name):
+        return self.collection
+
+class SlowMongo:
+    def __init__(self, rtt, outage=None):
+        self.db = SlowDB(SlowCollection(rtt, outage))
+
+class BenchApp:
+    def __init__(self, spool_path):
+        self.config = {'AUDIT_SPOOL_PATH': spool_path}
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "mean": statistics.mean(samples),
+        "p50": samples[len(samples) // 2],
+        "p99": samples[int(len(samples) * 0.99)],
+    }
+
+def bench_sync(rtt, events):
+    collection = SlowCollection(rtt)
+    samples = []
+    for i in range(events):
+        start = time.perf_counter()
+        collection.insert_one({"event": "login", "userId": str(i)})
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+def bench_record(rtt, events):
+    mongo = SlowMongo(rtt)
+    with tempfile.TemporaryDirectory() as tmp:
+        audit_log = AuditLog(mongo)
+        audit_log.init_app(BenchApp(os.path.join(tmp, 'audit_spool.jsonl')))
+        samples = []
+        for i in range(events):
+            start = time.perf_counter()
+            audit_log.record("login", user_id=str(i), ip="127.0.0.1")
+            samples.append(time.perf_counter() - start)
+        audit_log.shutdown()
+    assert mongo.db.collection.count == events
+    return percentiles(samples)
+
+def bench_requests(client, headers, count):
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        response = client.delete(f'/api/v1/biometrics/{i:024x}', headers=headers)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return percentiles(samples)
+
+def bench_flask(rtt, count):
+    app = create_app()
+    app.config['TESTING'] = True
+    routes.Biometric.delete = classmethod(lambda cls, biometric_id, user_id: True)
+    with app.app_context():
+        token = create_access_token(identity="5f1d7f3e9b1e8a3c4d2b6a10")
+    headers = {'Authorization': f'Bearer {token}'}
+    # werkzeug's Client: the pinned werkzeug breaks Flask 2.0's test_client
+    client = Client(app)
+    results = {}
+
+    audit_event = routes.audit_event
+    routes.audit_event = lambda *args, **kwargs: None
+    bench_requests(client, headers, 100)
+    results["request, no audit"] = bench_requests(client, headers, count)
+    routes.audit_event = audit_event
+
+    audit.mongo = SlowMongo(rtt)
+    bench_requests(client, headers, 100)
+    results["request, audit"] = bench_requests(client, headers, count)
+    audit.shutdown()
+    assert audit.mongo.db.collection.count == count + 100
+
+    # Flusher stuck in a 30 s server selection timeout, queue full: every
+    # event goes straight to the spool from the request thread.
+    audit.mongo = SlowMongo(rtt, outage=30)
+    for i in range(QUEUE_SIZE + 100):
+        audit.record("benchmark.fill", user_id=str(i))
+    results["request, Mongo down"] = bench_requests(client, headers, count)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt-ms', type=float, default=1.0)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    print(f"{args.requests} events, simulated Mongo round-trip {args.rtt_ms} ms, "
+          f"audit queue {QUEUE_SIZE}")
+    results = [("insert_one (sync)", bench_sync(rtt, args.requests)),
+               ("AuditLog.record", bench_record(rtt, args.requests))]
+    results.extend(bench_flask(rtt, args.requests).items())
+    for name, result in results:
+        print(f"{name:<22} mean {result['mean'] * 1e6:9.1f} us  "
+              f"p50 {result['p50'] * 1e6:9.1f} us  p99 {result['p99'] * 1e6:9.1f} us")
+    # Skip the atexit flush: the simulated outage would hold exit for 30 s
+    shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
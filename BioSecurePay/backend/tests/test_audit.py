@@ -0,0 +1,257 @@
+import threading
+import time
+import pytest
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure, ServerSelectionTimeoutError
+from audit import AuditLog, MAX_DETAIL_LENGTH
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.insert_calls = 0
+        self.down = False
+        self.delay = 0
+        self.reject = set()
+        self.indexes = []
+
+    def insert_many(self, docs, ordered=True):
+        time.sleep(self.delay)
+        if self.down:
+            raise ServerSelectionTimeoutError("mongo down")
+        self.insert_calls += 1
+        errors = [{"index": i} for i, doc in enumerate(docs) if doc["meta"]["userId"] in self.reject]
+        self.docs.extend(doc for doc in docs if doc["meta"]["userId"] not in self.reject)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def create_index(self, key, **kwargs):
+        self.indexes.append((key, kwargs))
+
+class FakeDB:
+    def __init__(self):
+        self.collection = FakeCollection()
+        self.created = []
+        self.commands = []
+        self.existing = None
+        self.timeseries_supported = True
+
+    def create_collection(self, name, **kwargs):
+        if self.existing is not None or self.created:
+            raise CollectionInvalid("collection %s already exists" % name)
+        if not self.timeseries_supported:
+            raise OperationFailure("unknown option to create: timeseries")
+        self.created.append((name, kwargs))
+
+    def list_collections(self, filter=None):
+        return iter([{"name": filter["name"], "type": self.existing or "timeseries"}])
+
+    def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+    def __getitem__(self, name):
+        return self.collection
+
+class FakeMongo:
+    def __init__(self):
+        self.db = FakeDB()
+
+class FakeApp:
+    def __init__(self, **config):
+        self.config = config
+
+@pytest.fixture
+def mongo():
+    return FakeMongo()
+
+@pytest.fixture
+def audit(mongo, tmp_path):
+    audit = AuditLog(mongo)
+    audit.init_app(FakeApp(
+        AUDIT_BATCH_SIZE=10,
+        AUDIT_FLUSH_INTERVAL=60,
+        AUDIT_RETENTION_DAYS=30,
+        AUDIT_SPOOL_PATH=str(tmp_path / 'audit_spool.jsonl')
+    ))
+    yield audit
+    audit.shutdown()
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+def test_record_is_batched(audit, mongo):
+    for i in range(25):
+        audit.record("login", user_id=str(i))
+    assert wait_for(lambda: len(mongo.db.collection.docs) == 20)
+    assert mongo.db.collection.insert_calls == 2
+    audit.shutdown()
+    assert len(mongo.db.collection.docs) == 25
+    assert mongo.db.collection.insert_calls == 3
+
+def test_flushes_on_interval(mongo, tmp_path):
+    audit = AuditLog(mongo)
+    audit.init_app(FakeApp(AUDIT_FLUSH_INTERVAL=0.05, AUDIT_SPOOL_PATH=str(tmp_path / 'spool.jsonl')))
+    audit.record("biometric.delete", user_id="u1", success=False, biometricId="b1")
+    assert wait_for(lambda: len(mongo.db.collection.docs) == 1)
+    doc = mongo.db.collection.docs[0]
+    assert doc["meta"] == {"event": "biometric.delete", "userId": "u1"}
+    assert doc["success"] is False
+    assert doc["details"] == {"biometricId": "b1"}
+    audit.shutdown()
+
+def test_creates_timeseries_collection_with_ttl(audit, mongo):
+    audit.record("register", user_id="u1")
+    audit.shutdown()
+    name, options = mongo.db.created[0]
+    assert name == "audit_events"
+    assert options["timeseries"]["timeField"] == "timestamp"
+    assert options["timeseries"]["metaField"] == "meta"
+    assert options["expireAfterSeconds"] == 30 * 86400
+
+def test_spools_when_mongo_down_and_replays(audit, mongo, tmp_path):
+    mongo.db.collection.down = True
+    audit.record("login", user_id="u1", success=False)
+    audit.shutdown()
+    assert mongo.db.collection.docs == []
+    assert list(tmp_path.glob('audit_spool.jsonl*'))
+
+    mongo.db.collection.down = False
+    audit.record("login", user_id="u1")
+    audit.shutdown()
+    assert [d["success"] for d in mongo.db.collection.docs] == [False, True]
+    assert not list(tmp_path.glob('audit_spool.jsonl*'))
+
+def test_full_queue_spills_to_spool(mongo, tmp_path):
+    audit = AuditLog(mongo)
+    audit.init_app(FakeApp(AUDIT_QUEUE_SIZE=1, AUDIT_SPOOL_PATH=str(tmp_path / 'spool.jsonl')))
+    mongo.db.collection.down = True
+    for i in range(50):
+        audit.record("login", user_id=str(i))
+    mongo.db.collection.down = False
+    audit.shutdown()
+    assert sorted(d["meta"]["userId"] for d in mongo.db.collection.docs) == sorted(str(i) for i in range(50))
+
+def test_disabled_until_init_app(mongo):
+    audit = AuditLog(mongo)
+    audit.record("login", user_id="u1")
+    assert audit._thread is None
+
+def test_existing_timeseries_collection_gets_retention_updated(audit, mongo):
+    mongo.db.existing = "timeseries"
+    audit.record("register", user_id="u1")
+    audit.shutdown()
+    assert mongo.db.commands == [(("collMod", "audit_events"), {"expireAfterSeconds": 30 * 86400})]
+    assert len(mongo.db.collection.docs) == 1
+
+def test_falls_back_to_ttl_index_without_timeseries_support(audit, mongo):
+    mongo.db.timeseries_supported = False
+    audit.record("register", user_id="u1")
+    audit.shutdown()
+    assert mongo.db.collection.indexes == [("timestamp", {"expireAfterSeconds": 30 * 86400})]
+    assert len(mongo.db.collection.docs) == 1
+
+def test_bad_spool_line_is_quarantined(audit, mongo, tmp_path):
+    spool = tmp_path / 'audit_spool.jsonl'
+    spool.write_text('{"bad\n')
+    audit.record("login", user_id="u1")
+    audit.shutdown()
+    assert [d["meta"]["userId"] for d in mongo.db.collection.docs] == ["u1"]
+    assert (tmp_path / 'audit_spool.jsonl.bad').read_text() == '{"bad\n'
+    assert not spool.exists()
+
+def test_dead_flusher_is_restarted(audit, mongo):
+    audit.record("login", user_id="u1")
+    audit.shutdown()
+    assert audit._thread is None
+    audit._thread = threading.Thread(target=lambda: None)
+    audit._thread.start()
+    audit._thread.join()
+    audit.record("login", user_id="u2")
+    assert audit._thread.is_alive()
+
+def test_partial_bulk_failure_respools_only_rejected(audit, mongo, tmp_path):
+    mongo.db.collection.reject = {"u2"}
+    for user_id in ("u1", "u2", "u3"):
+        audit.record("login", user_id=user_id)
+    audit.shutdown()
+    assert sorted(d["meta"]["userId"] for d in mongo.db.collection.docs) == ["u1", "u3"]
+
+    mongo.db.collection.reject = set()
+    audit.record("login", user_id="u4")
+    audit.shutdown()
+    assert sorted(d["meta"]["userId"] for d in mongo.db.collection.docs) == ["u1", "u2", "u3", "u4"]
+
+def test_record_not_blocked_by_slow_replay(mongo, tmp_path):
+    audit = AuditLog(mongo)
+    audit.init_app(FakeApp(AUDIT_QUEUE_SIZE=1, AUDIT_FLUSH_INTERVAL=0.01,
+                           AUDIT_SPOOL_PATH=str(tmp_path / 'spool.jsonl')))
+    mongo.db.collection.down = True
+    for i in range(5):
+        audit.record("login", user_id=str(i))
+    mongo.db.collection.delay = 0.5
+    time.sleep(0.1)
+    start = time.monotonic()
+    for i in range(5, 10):
+        audit.record("login", user_id=str(i))
+    assert time.monotonic() - start < 0.2
+    mongo.db.collection.delay = 0
+    mongo.db.collection.down = False
+    audit.shutdown()
+    assert sorted(int(d["meta"]["userId"]) for d in mongo.db.collection.docs) == list(range(10))
+
+def test_init_app_twice_keeps_queue(audit, mongo):
+    queue = audit._queue
+    audit.init_app(FakeApp(AUDIT_QUEUE_SIZE=5))
+    assert audit._queue is queue
+
+def test_oversized_details_are_clipped(audit, mongo):
+    audit.record("transaction.authenticate", user_id="u1", success=False,
+                 factors=["x" * 10 ** 7] * 1000, amount=10 ** 30)
+    audit.shutdown()
+    details = mongo.db.collection.docs[0]["details"]
+    assert len(details["factors"]) == 21
+    assert details["factors"][0].startswith("x" * MAX_DETAIL_LENGTH + "...[")
+    assert details["amount"] == str(10 ** 30)
+
+def test_unencodable_event_is_quarantined(audit, mongo, tmp_path):
+    audit._queue.put({"meta": {"event": "login", "userId": "huge"}, "blob": "x" * (17 * 1024 * 1024)})
+    for i in range(30):
+        audit.record("login", user_id=str(i))
+    audit.shutdown()
+    assert sorted(int(d["meta"]["userId"]) for d in mongo.db.collection.docs) == list(range(30))
+    assert len((tmp_path / 'audit_spool.jsonl.bad').read_text().splitlines()) == 1
+
+def test_rejected_event_does_not_block_spool(audit, mongo, tmp_path):
+    mongo.db.collection.reject = {"poison"}
+    audit.record("login", user_id="poison")
+    audit.shutdown()
+    audit.record("login", user_id="u1")
+    audit.shutdown()
+    mongo.db.collection.down = True
+    for user_id in ("u2", "u3", "u4"):
+        audit.record("login", user_id=user_id)
+    audit.shutdown()
+    mongo.db.collection.down = False
+    audit.record("login", user_id="u5")
+    audit.shutdown()
+    assert sorted(d["meta"]["userId"] for d in mongo.db.collection.docs) == ["u1", "u2", "u3", "u4", "u5"]
+    assert [p.name for p in tmp_path.glob('audit_spool.jsonl*')] == ['audit_spool.jsonl.bad']
+    assert '"poison"' in (tmp_path / 'audit_spool.jsonl.bad').read_text()
+
+def test_shutdown_does_not_wait_on_stuck_mongo(audit, mongo, tmp_path):
+    mongo.db.collection.delay = 1.0
+    mongo.db.collection.down = True
+    for i in range(15):
+        audit.record("login", user_id=str(i))
+    start = time.monotonic()
+    audit.shutdown(timeout=0.3)
+    assert time.monotonic() - start < 0.6
+    mongo.db.collection.delay = 0
+    mongo.db.collection.down = False
+    time.sleep(1.0)
+    audit.record("login", user_id="15")
+    audit.shutdown()
+    assert {int(d["meta"]["userId"]) for d in mongo.db.collection.docs} == set(range(16))
@@ -1,5 +1,7 @@
 import pytest
+import requests
 from app import create_app
+from extensions import audit
 from flask_jwt_extended import create_access_token
 from bson import ObjectId
 import json
@@ -33,6 +35,24 @@ def user_id(client, mongo):
 def token(user_id):
     return create_access_token(identity=user_id)
 
+@pytest.fixture
+def audit_events(monkeypatch):
+    events = []
+    monkeypatch.setattr(audit, 'record', lambda event, **kwargs: events.append((event, kwargs)))
+    return events
+
+def auth_events(audit_events):
+    return [kwargs for event, kwargs in audit_events if event == 'transaction.authenticate']
+
+def mock_paystack_initialize(monkeypatch):
+    def mock_post(*args, **kwargs):
+        class MockResponse:
+            status_code = 200
+            def json(self):
+                return {"data": {"reference": "mock_ref_123"}}
+        return MockResponse()
+    monkeypatch.setattr(requests, 'post', mock_post)
+
 def test_register_success(client, mongo):
     mongo.db.users.drop()
     response = client.post('/api/v1/register', json={
@@ -69,6 +89,18 @@ def test_login_invalid_credentials(client):
     assert response.status_code == 401
     assert 'error' in response.json
 
+def test_login_failure_audit_hides_identifier(client, audit_events):
+    response = client.post('/api/v1/login', json={
+        'emailOrPhone': 'my-secret-password',
+        'password': 'wrong'
+    })
+    assert response.status_code == 401
+    event, kwargs = audit_events[-1]
+    assert event == 'login'
+    assert kwargs['success'] is False
+    assert 'my-secret-password' not in json.dumps(kwargs)
+    assert len(kwargs['identifierHash']) == 32
+
 def test_kyc_verify_success(client, user_id, token, monkeypatch):
     def mock_post(*args, **kwargs):
         class MockResponse:
@@ -192,3 +224,73 @@ def test_security_invalid_input(client, user_id, token):
     }, headers={'Authorization': f'Bearer {token}'})
     assert response.status_code == 400
     assert 'BVN and documents required' in response.json['error']
+
+def test_transaction_authenticate_malformed(client, audit_events, token):
+    txn_id = str(ObjectId())
+    response = client.post(f'/api/v1/transaction/authenticate/{txn_id}', json={
+        'biometricTypes': ['fingerprint'],
+        'templates': []
+    }, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 400
+    events = auth_events(audit_events)
+    assert len(events) == 1
+    assert events[0]['success'] is False
+    assert events[0]['transactionId'] == txn_id
+    assert events[0]['reason'] == 'malformed request'
+
+@pytest.mark.parametrize('txn_id', ['not-an-object-id', str(ObjectId())])
+def test_transaction_authenticate_unknown_transaction(client, audit_events, token, txn_id):
+    response = client.post(f'/api/v1/transaction/authenticate/{txn_id}', json={
+        'biometricTypes': ['fingerprint'],
+        'templates': ['mock_fingerprint_template']
+    }, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 404
+    events = auth_events(audit_events)
+    assert len(events) == 1
+    assert events[0]['success'] is False
+    assert events[0]['reason'] == 'Invalid transaction'
+
+def test_transaction_authenticate_mismatch_audited(client, audit_events, token, monkeypatch):
+    mock_paystack_initialize(monkeypatch)
+    client.post('/api/v1/enroll-biometrics', json={
+        'type': 'fingerprint',
+        'template': 'mock_fingerprint_template'
+    }, headers={'Authorization': f'Bearer {token}'})
+    response = client.post('/api/v1/transaction/initiate', json={
+        'amount': 5000,
+        'recipient': 'recipient@example.com',
+        'accountId': 'mock_acc_123'
+    }, headers={'Authorization': f'Bearer {token}'})
+    txn_id = response.json['transactionId']
+
+    response = client.post(f'/api/v1/transaction/authenticate/{txn_id}', json={
+        'biometricTypes': ['fingerprint'],
+        'templates': ['wrong_template']
+    }, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+    events = auth_events(audit_events)
+    assert len(events) == 1
+    assert events[0]['success'] is False
+    assert events[0]['factors'] == ['fingerprint']
+    assert 'mismatch' in events[0]['reason']
+
+def test_transaction_authenticate_duplicate_factors(client, audit_events, token, monkeypatch):
+    mock_paystack_initialize(monkeypatch)
+    client.post('/api/v1/enroll-biometrics', json={
+        'type': 'fingerprint',
+        'template': 'mock_fingerprint_template'
+    }, headers={'Authorization': f'Bearer {token}'})
+    response = client.post('/api/v1/transaction/initiate', json={
+        'amount': 20000,
+        'recipient': 'recipient@example.com',
+        'accountId': 'mock_acc_123'
+    }, headers={'Authorization': f'Bearer {token}'})
+    txn_id = response.json['transactionId']
+
+    response = client.post(f'/api/v1/transaction/authenticate/{txn_id}', json={
+        'biometricTypes': ['fingerprint', 'fingerprint'],
+        'templates': ['mock_fingerprint_template', 'mock_fingerprint_template']
+    }, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+    assert response.json['error'] == 'Duplicate biometric factors'
+    assert auth_events(audit_events)[0]['success'] is False